@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
+import array
+import functools
 import logging
+import os
 import pathlib
+import pickle
 import subprocess
-import time
 import typing
+from collections import namedtuple
 
 import click
 import munch
@@ -17,6 +21,29 @@ logging.basicConfig(level=logging.WARNING)
 
 REPO_PATH = pathlib.Path("~/code/root-infrastructure/terraform").expanduser()
 
+PROJECT_CACHE_DIR = pathlib.Path("~/.cache/terraform-runner").expanduser()
+PROJECT_CACHE_KEEP = 10
+
+# Per-project metadata precomputed once so filter callbacks don't chase
+# dict.get chains per candidate
+ProjectEntry = namedtuple(
+    "ProjectEntry", ("path", "environment", "region", "relative", "stat_key")
+)
+
+
+def stat_key(path: pathlib.Path) -> typing.Optional[typing.Tuple[int, int]]:
+    """
+    Identifies a path by device+inode, the same equivalence samefile
+    uses, for one stat per path instead of one per comparison
+    :param path:
+    :return: (st_dev, st_ino) or None if the path doesn't exist
+    """
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
 
 def terrify_args(func: typing.Callable[[click.Context, str, str], None]):
     """
@@ -36,61 +63,166 @@ def terrify_args(func: typing.Callable[[click.Context, str, str], None]):
     return wrapped_func
 
 
+@functools.cache
+def default_git_branch() -> str:
+    return subprocess.check_output(
+        ["git", "rev-parse", "--abbrev-ref", "origin/HEAD"],
+        cwd=REPO_PATH,
+        text=True,
+    ).strip()
+
+
+def load_project_finder() -> terraform.project.ProjectFinder:
+    """
+    Builds the ProjectFinder, reusing an on-disk snapshot of the scan
+    when the repo is clean and HEAD hasn't moved since it was taken
+    :return: finder with projects/metadata populated
+    """
+    head = None
+    dirty = True
+    try:
+        head = subprocess.check_output(
+            ["git", "-C", str(REPO_PATH), "rev-parse", "HEAD"], text=True
+        ).strip()
+        dirty = bool(
+            subprocess.check_output(
+                ["git", "-C", str(REPO_PATH), "status", "--porcelain"], text=True
+            ).strip()
+        )
+    except subprocess.CalledProcessError:
+        pass
+
+    cache_file = PROJECT_CACHE_DIR / f"projects-{head}.pickle"
+    if head and not dirty and cache_file.is_file():
+        try:
+            with open(cache_file, "rb") as f:
+                return terraform.project.ProjectFinder.restore(pickle.load(f))
+        except Exception:
+            # A truncated/corrupt snapshot (interrupted run, full
+            # disk) shouldn't wedge every invocation on this HEAD;
+            # drop it and fall through to a fresh scan
+            logging.getLogger(__name__).warning(
+                "Discarding unreadable project snapshot %s", cache_file
+            )
+            cache_file.unlink(missing_ok=True)
+
+    finder = terraform.project.ProjectFinder(
+        REPO_PATH,
+        path_parser=terraform.project.project_environment_region_parser,
+    )
+
+    if head and not dirty:
+        PROJECT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Write-then-rename so readers never see a partial snapshot
+        tmp_file = cache_file.with_suffix(".tmp")
+        with open(tmp_file, "wb") as f:
+            pickle.dump(finder.save_state(), f)
+        os.replace(tmp_file, cache_file)
+        snapshots = sorted(
+            PROJECT_CACHE_DIR.glob("projects-*.pickle"),
+            key=lambda p: p.stat().st_mtime,
+        )
+        for stale in snapshots[:-PROJECT_CACHE_KEEP]:
+            stale.unlink()
+
+    return finder
+
+
+def project_state(ctx: click.Context) -> munch.Munch:
+    """
+    Builds the project finder, metadata index, and filter mask on
+    first use so invocations that never touch projects (--help)
+    don't pay for the repo walk
+    :param ctx: click context
+    :return: ctx.obj with project state populated
+    """
+    if "project_finder" not in ctx.obj:
+        finder = load_project_finder()
+        finder.sort_projects()
+        ctx.obj.project_finder = finder
+        ctx.obj.change_finder = terraform.project.ChangeFinder(finder)
+        ctx.obj.project_index = [
+            ProjectEntry(
+                project,
+                metadata.get("environment", ""),
+                metadata.get("region", ""),
+                str(project.relative_to(finder.base_path)),
+                stat_key(project),
+            )
+            for project, metadata in (
+                (p, finder.project_metadata.get(p, {})) for p in finder.projects
+            )
+        ]
+        ctx.obj.mask = array.array("b", [1] * len(finder.projects))
+    return ctx.obj
+
+
+def selected_projects(ctx: click.Context) -> typing.List[pathlib.Path]:
+    """
+    Materializes the projects whose mask bit survived every filter
+    :param ctx: click context holding project_index and mask
+    :return: filtered project paths
+    """
+    state = project_state(ctx)
+    return [entry.path for entry, keep in zip(state.project_index, state.mask) if keep]
+
+
+def intersect_mask(state: munch.Munch, keep: typing.Iterable[bool]) -> None:
+    """
+    ANDs one filter's per-project verdicts into the shared mask.
+    Filters only ever clear bits so they compose in any order
+    :param state: project state holding the mask
+    :param keep: verdict per project, aligned with project_index
+    """
+    for i, keep_project in enumerate(keep):
+        if not keep_project:
+            state.mask[i] = 0
+
+
 def git_changes(ctx, _, commit):
     if commit is None:
         return
+    if commit == "__HEAD__":
+        commit = default_git_branch()
 
-    change_finder = terraform.project.ChangeFinder(ctx.obj.project_finder)
-    changed_projects = change_finder.git_diff(commit)
-    ctx.obj.projects = [
-        project
-        for project in ctx.obj.projects
-        if any(project.samefile(changed) for changed in changed_projects)
-    ]
+    state = project_state(ctx)
+    changed = {key for p in state.change_finder.git_diff(commit) if (key := stat_key(p))}
+    intersect_mask(state, (entry.stat_key in changed for entry in state.project_index))
 
 
 @terrify_args
 def environment_filter(ctx, _, environment):
-    ctx.obj.projects = [
-        project
-        for project in ctx.obj.projects
-        if ctx.obj.project_finder.project_metadata.get(project, {}).get(
-            "environment", ""
-        )
-        == environment
-    ]
+    state = project_state(ctx)
+    intersect_mask(
+        state, (entry.environment == environment for entry in state.project_index)
+    )
 
 
 @terrify_args
 def region_filter(ctx, _, region):
-    ctx.obj.projects = [
-        project
-        for project in ctx.obj.projects
-        if ctx.obj.project_finder.project_metadata.get(project, {}).get("region", "")
-        == region
-    ]
+    state = project_state(ctx)
+    intersect_mask(state, (entry.region == region for entry in state.project_index))
 
 
 @terrify_args
 def project_filter(ctx, _, project):
-    ctx.obj.projects = [
-        proj
-        for proj in ctx.obj.projects
-        if str(proj.relative_to(ctx.obj.project_finder.base_path)).startswith(project)
-    ]
+    state = project_state(ctx)
+    intersect_mask(
+        state, (entry.relative.startswith(project) for entry in state.project_index)
+    )
 
 
 def remote_modules(ctx, _, module):
     if module is None:
         return
 
-    change_finder = terraform.project.ChangeFinder(ctx.obj.project_finder)
-    projects_with_module = change_finder.remote_module(module)
-    ctx.obj.projects = [
-        candidate
-        for candidate in ctx.obj.projects
-        if any(candidate.samefile(project) for project in projects_with_module)
-    ]
+    state = project_state(ctx)
+    projects_with_module = {
+        key for p in state.change_finder.remote_module(module) if (key := stat_key(p))
+    }
+    intersect_mask(
+        state, (entry.stat_key in projects_with_module for entry in state.project_index)
+    )
 
 
 filter_git_changes = click.option(
@@ -102,16 +234,13 @@ filter_git_changes = click.option(
     expose_value=False,
 )
 
-default_git_branch = subprocess.check_output(
-    ["git", "rev-parse", "--abbrev-ref", "origin/HEAD"],
-    cwd=REPO_PATH,
-    text=True,
-).strip()
 filter_git_changes_master = click.option(
     "-c",
     "git_changes",
-    flag_value=default_git_branch,
-    help=f"Git diff current working tree to {default_git_branch}",
+    # Resolved to the actual default branch inside the callback so
+    # startup doesn't pay for a git subprocess
+    flag_value="__HEAD__",
+    help="Git diff current working tree to origin/HEAD",
     callback=git_changes,
     expose_value=False,
 )
@@ -179,22 +308,15 @@ filter_options = add_options(
 @click.pass_context
 def cli(ctx):
     ctx.ensure_object(munch.Munch)
-    finder = terraform.project.ProjectFinder(
-        REPO_PATH,
-        path_parser=terraform.project.project_environment_region_parser,
-    )
-    finder.sort_projects()
-    ctx.obj.project_finder = finder
-    ctx.obj.projects = finder.projects[:]
 
 
 @cli.command()
 @click.pass_context
 def benchmark(ctx):
-    pf = ctx.obj.project_finder
+    state = project_state(ctx)
+    pf = state.project_finder
 
-    c = terraform.project.ChangeFinder(pf)
-    projects = c.git_diff()
+    projects = state.change_finder.git_diff()
     click.echo("\n".join(str(p.relative_to(pf.base_path)) for p in projects))
     # tf = terraform.runner.Runner(project, cred_helper=cred_helper)
 
@@ -203,9 +325,9 @@ def benchmark(ctx):
 @filter_options
 @click.pass_context
 def lst(ctx):
-    base_path = ctx.obj.project_finder.base_path
+    base_path = project_state(ctx).project_finder.base_path
 
-    for project in ctx.obj.projects:
+    for project in selected_projects(ctx):
         click.echo(project.relative_to(base_path))
 
 
@@ -234,9 +356,7 @@ def handle_project_interaction(project, process, cred_helper):
                 runner = terraform.runner.Runner(project, cred_helper=cred_helper)
                 apply_process = runner.apply()
                 while apply_process.returncode is None:
-                    if not (err := apply_process.read()):
-                        time.sleep(0.25)
-                    else:
+                    if err := apply_process.read(timeout=0.25):
                         click.echo(err, nl=False)
                 if apply_process.returncode != 0 and not click.confirm(
                     "Apply failed. Would you like to continue?"
@@ -257,8 +377,8 @@ def handle_project_interaction(project, process, cred_helper):
 @filter_options
 @click.pass_context
 def run(ctx):
-    base_path = ctx.obj.project_finder.base_path
-    projects = ctx.obj.projects
+    base_path = project_state(ctx).project_finder.base_path
+    projects = selected_projects(ctx)
 
     if len(projects) == 0:
         click.echo("No projects found!")
@@ -270,7 +390,7 @@ def run(ctx):
 
     click.confirm(f"\nStart planning?", abort=True)
 
-    cred_helper = terraform.credentials.RoleToProfileMapping(contrib.root.ROLE_MAPPING)
+    cred_helper = terraform.credentials.RoleToProfileMapping(contrib.root.role_mapping())
     runner = terraform.runner.RunnerPool(projects=projects, cred_helper=cred_helper)
 
     try:
@@ -280,9 +400,7 @@ def run(ctx):
             if proc.returncode is None:
                 click.echo(f"Waiting for {project} plan to complete")
             while proc.returncode is None:
-                if not (out := proc.read()):
-                    time.sleep(0.25)
-                else:
+                if out := proc.read(timeout=0.25):
                     click.echo(out, nl=False)
             relative_project = project.relative_to(base_path)
             handle_project_interaction(relative_project, proc, cred_helper)
@@ -1,7 +1,8 @@
+import functools
+import json
 import os
 import pathlib
 import re
-import subprocess
 from collections import defaultdict
 
 import typing
@@ -14,47 +15,148 @@ import util
 ROOT_INFRASTRUCTURE_DIR = pathlib.Path("~/code/root-infrastructure").expanduser()
 os.environ["ROOT_INFRASTRUCTURE_DIR"] = str(ROOT_INFRASTRUCTURE_DIR)
 
+ROLE_MAPPING_CACHE = pathlib.Path(
+    "~/.cache/terraform-runner/role_mapping.json"
+).expanduser()
+
+_WORD_ARRAY_RE = re.compile(r"%w[\[(]([^\])]*)[\])]")
+_QUOTED_STRING_RE = re.compile(r"""['"]([^'"]+)['"]""")
+_CONSTANT_RE = re.compile(
+    r"^\s*([A-Z][A-Z0-9_]*)\s*=\s*(.*?)(?=^\s*[A-Z][A-Z0-9_]*\s*=|^\s*end\b|\Z)",
+    re.DOTALL | re.MULTILINE,
+)
+
+
+def _account_ids(node: typing.Any) -> typing.Iterator[str]:
+    """
+    Flattens whatever structure aws-accounts.yml uses
+    into a stream of account id strings
+    """
+    if isinstance(node, dict):
+        for value in node.values():
+            yield from _account_ids(value)
+    elif isinstance(node, (list, tuple)):
+        for value in node:
+            yield from _account_ids(value)
+    else:
+        yield str(node)
+
+
+def _resolve_term(
+    term: str,
+    constants: typing.Dict[str, typing.List[str]],
+    accounts: typing.Any,
+) -> typing.List[str]:
+    """
+    Evaluates a single term of a ruby constant assignment
+    """
+    term = term.strip()
+    for suffix in (".freeze", ".map(&:to_s)"):
+        if term.endswith(suffix):
+            term = term[: -len(suffix)]
+
+    if match := _WORD_ARRAY_RE.search(term):
+        return match[1].split()
+    if term.startswith("["):
+        return _QUOTED_STRING_RE.findall(term)
+    if term in constants:
+        return constants[term]
+    if ".keys" in term and isinstance(accounts, dict):
+        return [str(k) for k in accounts]
+    if "ACCOUNTS" in term or "YAML" in term:
+        return list(_account_ids(accounts))
+    raise ValueError(f"Can't evaluate ruby expression {term!r}")
+
+
+def _parse_accounts_module(
+    account_module: str, accounts: typing.Any
+) -> typing.Dict[str, typing.List[str]]:
+    """
+    Evaluates the constant assignments in the ruby Accounts module
+    without a ruby interpreter. Supports %w word arrays, quoted array
+    literals, references to earlier constants, +/- set arithmetic and
+    lookups into the aws-accounts.yml data
+    """
+    constants = {}
+    for name, value in _CONSTANT_RE.findall(account_module):
+        result = None
+        operator = "+"
+        for token in re.split(r"\s([+-])\s", value.strip()):
+            if token in ("+", "-"):
+                operator = token
+                continue
+            term = _resolve_term(token, constants, accounts)
+            if result is None:
+                result = list(term)
+            elif operator == "+":
+                result += [t for t in term if t not in result]
+            else:
+                result = [t for t in result if t not in term]
+        constants[name] = result or []
+    return constants
+
 
 def get_role_mapping(root_infrastructure_dir: pathlib.Path) -> typing.Dict[str, str]:
     """
-    Sketchy ruby shenanigans to extract the account->profile
-    mapping from ruby code
+    Extracts the account->profile mapping from the ruby infrastructure
+    code by parsing it directly (no ruby subprocess). The computed
+    mapping is cached on disk keyed by the source files' mtimes
     :param root_infrastructure_dir:
     :return:
     """
-    with open(root_infrastructure_dir / "lib/infrastructure/aws.rb", "r") as f:
+    aws_rb = root_infrastructure_dir / "lib/infrastructure/aws.rb"
+    accounts_yml = root_infrastructure_dir / "aws-accounts.yml"
+    cache_key = [aws_rb.stat().st_mtime, accounts_yml.stat().st_mtime]
+
+    role_mapping = defaultdict(lambda: "terraform-production")
+
+    if ROLE_MAPPING_CACHE.is_file():
+        # An unreadable/corrupt cache is just a miss; recompute and
+        # overwrite it rather than wedging every invocation
+        try:
+            cached = json.loads(ROLE_MAPPING_CACHE.read_text())
+            if cached.get("key") == cache_key:
+                role_mapping.update(cached["mapping"])
+                return role_mapping
+        except (ValueError, OSError):
+            pass
+
+    with open(aws_rb, "r") as f:
         aws_account_info = f.read()
 
-    account_module = (
-        re.search(
-            r" {4}module Accounts.*?^ {4}end",
-            aws_account_info,
-            flags=re.DOTALL | re.MULTILINE,
-        )[0]
-        .replace("Infrastructure::AWS::", "")
-        .replace(".underscore", ".gsub('-', '_')")
-    )
-    ruby_code = f"""
-    require 'yaml'
-    ACCOUNTS_FILE_LOCATION = '{root_infrastructure_dir / "aws-accounts.yml"}'
-    {account_module}
-    puts ({{
-        "terraform-reliability" => Accounts::RELIABILITY_ONLY,
-        "terraform-non-production" => Accounts::NON_PROTECTED
-    }}.to_yaml)
-    """
-
-    ruby_proc = subprocess.Popen(
-        ["ruby"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
-    )
-    ruby_output, _ = ruby_proc.communicate(input=ruby_code.encode("ascii"))
+    account_module = re.search(
+        r" {4}module Accounts.*?^ {4}end",
+        aws_account_info,
+        flags=re.DOTALL | re.MULTILINE,
+    )[0].replace("Infrastructure::AWS::", "")
 
-    role_mapping = defaultdict(lambda: "terraform-production")
-    role_mapping.update(
-        {acc: role for role, ids in util.yaml.loads(ruby_output).items() for acc in ids}
-    )
+    with open(accounts_yml, "r") as f:
+        accounts = util.yaml.loads(f.read())
+
+    constants = _parse_accounts_module(account_module, accounts)
+    mapping = {
+        acc: role
+        for role, ids in (
+            ("terraform-reliability", constants["RELIABILITY_ONLY"]),
+            ("terraform-non-production", constants["NON_PROTECTED"]),
+        )
+        for acc in ids
+    }
 
+    ROLE_MAPPING_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    # Write-then-rename so a crash mid-write can't leave a partial file
+    tmp_file = ROLE_MAPPING_CACHE.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps({"key": cache_key, "mapping": mapping}))
+    os.replace(tmp_file, ROLE_MAPPING_CACHE)
+
+    role_mapping.update(mapping)
     return role_mapping
 
 
-ROLE_MAPPING = get_role_mapping(ROOT_INFRASTRUCTURE_DIR)
+@functools.cache
+def role_mapping() -> typing.Dict[str, str]:
+    """
+    Account->profile mapping for the default infrastructure repo,
+    computed on first use rather than at import
+    """
+    return get_role_mapping(ROOT_INFRASTRUCTURE_DIR)
@@ -1,9 +1,8 @@
-import concurrent
+import concurrent.futures
 import logging
 import multiprocessing
 import queue
 import threading
-import time
 
 from .process import NonBlockingProcess
 
@@ -11,32 +10,40 @@ from .process import NonBlockingProcess
 class FutureNonBlockingProcess:
     LOGGER = logging.getLogger(__name__)
 
+    __slots__ = ("_future", "_resolved")
+
     def __init__(self):
-        self._future = concurrent.futures.Future()
+        object.__setattr__(self, "_future", concurrent.futures.Future())
+        object.__setattr__(self, "_resolved", None)
         FutureNonBlockingProcess.LOGGER.debug("Created future %s", self._future)
 
     def set_result(self, obj):
         FutureNonBlockingProcess.LOGGER.debug("Setting future result %s", obj)
         self._future.set_result(obj)
 
+    def _process(self):
+        """
+        Returns the underlying process, blocking for the future the
+        first time and hitting the cached result afterwards so hot
+        read/returncode loops don't take the future's lock per access
+        """
+        process = self._resolved
+        if process is None:
+            process = self._future.result()
+            object.__setattr__(self, "_resolved", process)
+        return process
+
     def __getattr__(self, item):
-        FutureNonBlockingProcess.LOGGER.debug("Getting attribute %s", item)
-        if item in ("_future", "__dict__"):
-            return self.__getattribute__(item)
-        return getattr(self._future.result(), item)
+        return getattr(self._process(), item)
 
     def __setattr__(self, prop, value):
-        FutureNonBlockingProcess.LOGGER.debug("Setting attribute %s to %s", prop, value)
-        if prop == "_future":
-            self.__dict__[prop] = value
-            return
-        return setattr(self._future.result(), prop, value)
+        setattr(self._process(), prop, value)
 
 
 class Pool:
     # TODO move finished work to done queue so the results can be grabbed
     @staticmethod
-    def _manage_thread_pool(pool, jobs, shutdown):
+    def _manage_thread_pool(pool, jobs, free_slots, shutdown):
         logger = logging.getLogger(__name__)
         logger.debug("Thread manager running")
         while not shutdown.is_set():
@@ -47,18 +54,24 @@ class Pool:
                 logger.debug("No jobs available")
                 continue
 
-            scheduled = False
-            logger.debug("Looking for available pool slot")
-            while not scheduled:
-                for i in range(len(pool)):
-                    if pool[i] is None or pool[i].process.poll() is not None:
-                        logger.info("Found available pool slot %i. Scheduling job", i)
-                        pool[i] = NonBlockingProcess(*job[1], **job[2])
-                        job[0].set_result(pool[i])
-                        scheduled = True
-                        break
-                if not scheduled:
-                    time.sleep(0.01)
+            logger.debug("Waiting for available pool slot")
+            while True:
+                try:
+                    slot = free_slots.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if shutdown.is_set():
+                        return
+
+            logger.info("Found available pool slot %i. Scheduling job", slot)
+            pool[slot] = NonBlockingProcess(
+                *job[1],
+                # Exiting process hands its slot straight back instead of
+                # the manager polling every slot to find it
+                on_exit=lambda _process, s=slot: free_slots.put(s),
+                **job[2],
+            )
+            job[0].set_result(pool[slot])
 
     def __init__(self, workers=None):
         self._logger = logging.getLogger(__name__)
@@ -67,11 +80,14 @@ class Pool:
 
         self.pool = [None] * self.worker_count
         self.job_queue = queue.Queue()
+        self._free_slots = queue.Queue()
+        for slot in range(self.worker_count):
+            self._free_slots.put(slot)
         self._shutdown = threading.Event()
         self._logger.debug("Creating manager thread")
         self._manager = threading.Thread(
             target=self._manage_thread_pool,
-            args=(self.pool, self.job_queue, self._shutdown),
+            args=(self.pool, self.job_queue, self._free_slots, self._shutdown),
         )
         self._logger.info("Starting manager thread")
         self._manager.start()
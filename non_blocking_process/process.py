@@ -1,49 +1,133 @@
+import codecs
 import logging
 import io
-import queue
-import select
+import os
+import selectors
 import subprocess
 import threading
-import time
 
 
-class NonBlockingProcess:
+class _MemfdBuffer:
     """
-    A process whose output can be read without blocking
+    Append-only output buffer backed by a memfd. Pipe output is moved
+    with splice(2) so bytes never pass through Python unless someone
+    actually reads them
     """
 
-    OUTPUT_STREAMS = ("stdout", "stderr")
+    def __init__(self, name):
+        self._fd = os.memfd_create(name)
+        self.length = 0
 
-    @staticmethod
-    def reader(process, attribute, output):
+    def fill_from(self, fd):
+        size = os.splice(fd, self._fd, 1 << 20, offset_dst=self.length)
+        self.length += size
+        return size
+
+    def pread(self, position, size):
+        return os.pread(self._fd, size, position)
+
+    def __del__(self):
+        os.close(self._fd)
+
+
+class _ByteArrayBuffer:
+    """
+    Portable fallback for platforms without memfd_create/splice
+    """
+
+    def __init__(self, _name):
+        self._buf = bytearray()
+        self.length = 0
+
+    def fill_from(self, fd):
+        data = os.read(fd, io.DEFAULT_BUFFER_SIZE)
+        self._buf += data
+        self.length = len(self._buf)
+        return len(data)
+
+    def pread(self, position, size):
+        return bytes(self._buf[position : position + size])
+
+
+if hasattr(os, "memfd_create") and hasattr(os, "splice"):
+    OutputBuffer = _MemfdBuffer
+else:
+    OutputBuffer = _ByteArrayBuffer
+
+
+class _Reactor:
+    """
+    A single daemon thread watching every registered process pipe
+    (epoll on Linux via DefaultSelector) and filling the owning stream
+    buffer when the kernel has bytes. Replaces one reader thread per
+    process with one per interpreter
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger(f"{__name__}.reactor")
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread = None
+        # Self-pipe so a blocked poll notices newly-registered fds
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, data=None)
+
+    def register(self, fds_to_buffers, output_ready, on_eof):
         """
-        Reads from a process stream and queues the results
+        Starts watching a process's pipes. on_eof runs once every
+        registered fd has hit end-of-file
         """
-        buf = bytearray(io.DEFAULT_BUFFER_SIZE)
-        stream = getattr(process, attribute)
-        logger = logging.getLogger(f"{__name__}.reader.{attribute}")
+        with self._lock:
+            remaining = set(fds_to_buffers)
+            for fd, buffer in fds_to_buffers.items():
+                os.set_blocking(fd, False)
+                self._selector.register(
+                    fd, selectors.EVENT_READ, data=(buffer, remaining, output_ready, on_eof)
+                )
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"{__name__}.reactor", daemon=True
+                )
+                self._thread.start()
+        os.write(self._wakeup_w, b"\0")
+
+    def _run(self):
         while True:
-            stream_available = bool(select.select([stream.fileno()], [], [], 1)[0])
-            size = stream.readinto(buf)
-            logger.debug("Read %i bytes", size)
-            if size:
-                output.put(buf[:size].decode("utf-8"))
-            logger.debug("Size: %i; Available: %s", size, stream_available)
-            if not size and process.poll() is not None:
-                break
-        logger.debug("Done reading %s", stream)
+            for key, _events in self._selector.select(timeout=1):
+                if key.data is None:
+                    try:
+                        os.read(self._wakeup_r, io.DEFAULT_BUFFER_SIZE)
+                    except BlockingIOError:
+                        pass
+                    continue
+                buffer, remaining, output_ready, on_eof = key.data
+                try:
+                    size = buffer.fill_from(key.fd)
+                except BlockingIOError:
+                    continue
+                if size:
+                    output_ready.set()
+                    continue
+                # EOF
+                with self._lock:
+                    self._selector.unregister(key.fd)
+                    remaining.discard(key.fd)
+                    finished = not remaining
+                if finished:
+                    self._logger.debug("All pipes closed for fd %i's process", key.fd)
+                    on_eof()
 
-    @staticmethod
-    def _read_queue(q):
-        """
-        Reads everything out of a queue that was present
-        at the time of calling (more items may be added in the
-        meantime)
-        """
-        sentinel = object()
-        q.put(sentinel)
-        for val in iter(q.get, sentinel):
-            yield val
+
+_REACTOR = _Reactor()
+
+
+class NonBlockingProcess:
+    """
+    A process whose output can be read without blocking
+    """
+
+    OUTPUT_STREAMS = ("stdout", "stderr")
 
     @staticmethod
     def _check_stream_valid(stream):
@@ -52,44 +136,74 @@ class NonBlockingProcess:
                 f"Stream must be one of {NonBlockingProcess.OUTPUT_STREAMS}"
             )
 
-    def __init__(self, exc, **kwargs):
+    def __init__(self, exc, on_exit=None, **kwargs):
         self._logger = logging.getLogger(__name__)
         self._logger.info("Starting process %s", exc)
         self._lock = threading.RLock()
         self._args = (exc, kwargs)
+        self._on_exit = on_exit
+        self._output_ready = threading.Event()
+        self._done = threading.Event()
         self.process = subprocess.Popen(
             exc, bufsize=0, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs
         )
         for stream in self.__class__.OUTPUT_STREAMS:
-            setattr(self, stream, io.StringIO())
-            setattr(self, f"_{stream}_q", queue.Queue())
-            setattr(
-                self,
-                f"_{stream}_reader",
-                threading.Thread(
-                    target=self.__class__.reader,
-                    args=(self.process, stream, getattr(self, f"_{stream}_q")),
-                    name=f"{__name__}.reader.{stream}",
-                ),
-            )
-            getattr(self, f"_{stream}_reader").daemon = True
-            getattr(self, f"_{stream}_reader").start()
+            setattr(self, f"_{stream}_buf", OutputBuffer(stream))
+            setattr(self, f"_{stream}_pos", 0)
+            # One decoder per stream so codepoints split across chunks
+            # survive; reset whenever the read position moves
+            setattr(self, f"_{stream}_decoder", codecs.getincrementaldecoder("utf-8")())
+        _REACTOR.register(
+            {
+                getattr(self.process, stream).fileno(): getattr(self, f"_{stream}_buf")
+                for stream in self.__class__.OUTPUT_STREAMS
+            },
+            self._output_ready,
+            self._finalize,
+        )
+
+    def _finalize(self):
+        """
+        Runs on the reactor thread once both pipes hit EOF; the child
+        has exited (or abandoned its pipes) by then so reaping it
+        doesn't block other processes' I/O
+        """
+        self.process.wait()
+        self._mark_done()
+
+    def _mark_done(self):
+        """
+        Signals process exit exactly once and runs the
+        on_exit callback if one was provided
+        """
+        with self._lock:
+            if self._done.is_set():
+                return
+            self._done.set()
+        if self._on_exit is not None:
+            self._on_exit(self)
 
     def wait(self):
         """
-        Waits for the process to finish and writes
-        any output to internal stdout/stderr streams
+        Waits for the process to finish and rewinds the
+        streams so reads start from the beginning
         """
         self._logger.info("Waiting for process %s", self._args)
-        while self.process.poll() is None:
-            time.sleep(0.01)
+        self._done.wait()
         self._logger.info("Process finished. Updating streams")
         with self._lock:
             for stream in self.__class__.OUTPUT_STREAMS:
-                self._logger.info(f"Waiting for {stream}")
-                getattr(self, f"_{stream}_reader").join(timeout=1)
-                self.read(stream=stream)
-                getattr(self, stream).seek(0)
+                self.seek(0, stream=stream)
+
+    def wait_for_output(self, timeout=None):
+        """
+        Blocks until new output arrives on either stream (or timeout
+        expires) and returns whether any did. Wakes on the reactor's
+        notification rather than polling
+        """
+        ready = self._output_ready.wait(timeout)
+        self._output_ready.clear()
+        return ready
 
     def seek(self, position, stream="stdout"):
         """
@@ -97,7 +211,8 @@ class NonBlockingProcess:
         """
         with self._lock:
             self._check_stream_valid(stream)
-            getattr(self, stream).seek(position)
+            setattr(self, f"_{stream}_pos", position)
+            getattr(self, f"_{stream}_decoder").reset()
 
     def tell(self, stream="stdout"):
         """
@@ -105,39 +220,36 @@ class NonBlockingProcess:
         """
         with self._lock:
             self._check_stream_valid(stream)
-            return getattr(self, stream).tell()
+            return getattr(self, f"_{stream}_pos")
 
-    def read(self, size=-1, stream="stdout"):
+    def read(self, size=-1, stream="stdout", timeout=None):
         """
-        Reads contents of stream by first checking for
-        any enqueued values. If there is no new content,
-        an empty string is returned
+        Reads any new stream contents. If there is no new content,
+        an empty string is returned. When timeout is given, blocks
+        up to that many seconds for new output to arrive
         """
         self._check_stream_valid(stream)
+        if timeout is not None:
+            self._output_ready.wait(timeout)
+            self._output_ready.clear()
         with self._lock:
-            contents = self.__class__._read_queue(getattr(self, f"_{stream}_q"))
-            stream = getattr(self, stream)
-            last_position = stream.tell()
-            stream.seek(0, io.SEEK_END)
-            for c in contents:
-                stream.write(c)
-            stream.seek(last_position)
-            return stream.read(size)
+            buf = getattr(self, f"_{stream}_buf")
+            start = getattr(self, f"_{stream}_pos")
+            end = buf.length if size < 0 else min(start + size, buf.length)
+            setattr(self, f"_{stream}_pos", end)
+            return getattr(self, f"_{stream}_decoder").decode(
+                buf.pread(start, end - start)
+            )
 
     def readall(self, stream="stdout"):
         """
         Reads entire contents of stream.
         Position in stream remains unchanged
         """
-        stream_name = stream
-        self._check_stream_valid(stream_name)
-        stream = getattr(self, stream_name)
+        self._check_stream_valid(stream)
         with self._lock:
-            last_position = stream.tell()
-            stream.seek(0)
-            contents = self.read(stream=stream_name)
-            stream.seek(last_position)
-            return contents
+            buf = getattr(self, f"_{stream}_buf")
+            return buf.pread(0, buf.length).decode("utf-8", errors="replace")
 
     @property
     def returncode(self):
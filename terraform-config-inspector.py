@@ -1,4 +1,6 @@
+import concurrent.futures
 import json
+import os
 import pathlib
 import subprocess
 
@@ -19,47 +21,66 @@ tf_path = str(
 )
 
 
+def inspect_module(
+    prefix: str, module_path: pathlib.Path
+) -> typing.Tuple[str, pathlib.Path, typing.Dict]:
+    print(f"Checking {module_path}")
+    details = json.loads(
+        subprocess.check_output(
+            [TERRAFORM_CONFIG_INSPECTOR, "--json", module_path,], text=True,
+        )
+    )
+    return prefix, module_path, details
+
+
 def inspect_project(
     path: pathlib.Path,
 ) -> typing.Dict[str, typing.Dict[str, typing.Dict]]:
-    terraform_modules = [("", path)]
     managed_resources = {}
     local_modules = {}
     remote_modules = {}
 
-    while len(terraform_modules) > 0:
-        prefix, module_path = terraform_modules.pop(0)
-        print(f"Checking {module_path}")
-
-        details = json.loads(
-            subprocess.check_output(
-                [TERRAFORM_CONFIG_INSPECTOR, "--json", module_path,], text=True,
+    # The work is subprocess-bound so fan the inspector calls out to
+    # threads, submitting newly-discovered local modules as the parent
+    # module's result comes back
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=(os.cpu_count() or 1) * 2
+    ) as executor:
+        pending = {executor.submit(inspect_module, "", path)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
             )
-        )
+            for future in done:
+                prefix, module_path, details = future.result()
 
-        managed_resources.update(
-            {f"{prefix}{k}": v for k, v in details["managed_resources"].items()}
-        )
-
-        for name, metadata in details["module_calls"].items():
-            module_name = f"{prefix}module.{metadata['name']}"
-            if (
-                any(
-                    metadata["source"].startswith(prefix)
-                    for prefix in ("./", "../", "/")
+                managed_resources.update(
+                    {f"{prefix}{k}": v for k, v in details["managed_resources"].items()}
                 )
-                and (
-                    module_absolute_path := (Path(tf_path) / metadata["source"])
-                ).is_dir()
-            ):
-                print(f"Local module {metadata['source']}")
-                terraform_modules.append(
-                    (f"{prefix}module.{metadata['name']}.", module_absolute_path)
-                )
-                local_modules[module_name] = module_absolute_path.resolve()
-            else:
-                print(f"Non-local module {metadata['source']}")
-                remote_modules[module_name] = metadata["source"]
+
+                for name, metadata in details["module_calls"].items():
+                    module_name = f"{prefix}module.{metadata['name']}"
+                    if (
+                        any(
+                            metadata["source"].startswith(source_prefix)
+                            for source_prefix in ("./", "../", "/")
+                        )
+                        and (
+                            module_absolute_path := (Path(tf_path) / metadata["source"])
+                        ).is_dir()
+                    ):
+                        print(f"Local module {metadata['source']}")
+                        pending.add(
+                            executor.submit(
+                                inspect_module,
+                                f"{prefix}module.{metadata['name']}.",
+                                module_absolute_path,
+                            )
+                        )
+                        local_modules[module_name] = module_absolute_path.resolve()
+                    else:
+                        print(f"Non-local module {metadata['source']}")
+                        remote_modules[module_name] = metadata["source"]
 
     return {
         "resources": managed_resources,
@@ -1,8 +1,29 @@
+import functools
 import pathlib
 import re
 
 import typing
 
+_ROLE_ARN_RE = re.compile(r'\s*role_arn\s+=\s+"(.*?)"')
+
+
+@functools.lru_cache(maxsize=512)
+def _account_id_for_project(project: str) -> str:
+    """
+    Extracts IDs from role ARNs in
+    a Terraform config file
+    :param project: directory containing a main.tf with role_arn
+    :return: AWS account_id
+    """
+    with open(pathlib.Path(project) / "main.tf", "r") as f:
+        contents = f.read()
+    arns = _ROLE_ARN_RE.findall(contents)
+    # if len(set(arns)) != 1:
+    #     raise ValueError(f"Expected to find exactly 1 role arn {project}")
+    if len(arns) < 1:
+        raise ValueError(f"Couldn't find role arn for project {project}")
+    return arns[0].split(":")[4]
+
 
 class CredentialHelper:
     """
@@ -30,19 +51,12 @@ class RoleToProfileMapping(CredentialHelper):
     @staticmethod
     def account_id_for_project(project: pathlib.Path) -> str:
         """
-        Extracts IDs from role ARNs in
-        a Terraform config file
+        Extracts IDs from role ARNs in a Terraform config file.
+        Cached since a project's role_arn doesn't change mid-run
         :param project: directory containing a main.tf with role_arn
         :return: AWS account_id
         """
-        with open(project / "main.tf", "r") as f:
-            contents = f.read()
-        arns = re.findall(r'\s*role_arn\s+=\s+"(.*?)"', contents)
-        # if len(set(arns)) != 1:
-        #     raise ValueError(f"Expected to find exactly 1 role arn {project}")
-        if len(arns) < 1:
-            raise ValueError(f"Couldn't find role arn for project {project}")
-        return arns[0].split(":")[4]
+        return _account_id_for_project(str(project.resolve()))
 
     def __init__(self, account_id_to_profile_map: typing.Dict[str, str]):
         """
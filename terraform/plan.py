@@ -4,6 +4,12 @@ from colors import strip_color
 
 from terraform.types import TerraformPlanOutput
 
+_ANSI_COLOR_RE = re.compile(r"\x1b\[[\d;]*m")
+# Spaces followed by a change indicator (~ add/+ create/- destroy)
+_CHANGE_LINE_RE = re.compile(r"\s{2,}[~+\-]")
+# Separator line between the plan preamble and the change report
+_DASHES_RE = re.compile(r"-+")
+
 
 class PlanTextAnalyzer:
     @staticmethod
@@ -20,8 +26,10 @@ class PlanTextAnalyzer:
         # <= read (data resources)
         #
         # Terraform will perform the following actions:
-        return "Terraform will perform the following actions:" in (
-            strip_color(line).strip() for line in reversed(plan_text.splitlines())
+        # The marker contains no ANSI codes itself so one strip of the
+        # whole buffer beats color-stripping every line
+        return "Terraform will perform the following actions:" in _ANSI_COLOR_RE.sub(
+            "", plan_text
         )
 
     @staticmethod
@@ -39,7 +47,7 @@ class PlanTextAnalyzer:
             plan_start_line = next(
                 i
                 for i in range(len(clean_lines))
-                if re.fullmatch(r"-+", clean_lines[i])
+                if _DASHES_RE.fullmatch(clean_lines[i])
             )
         except StopIteration:
             raise ValueError("Couldn't find change start marker line")
@@ -55,12 +63,16 @@ class PlanTextAnalyzer:
         :return:
         """
 
+        # Strip color codes from the whole buffer in one pass instead of
+        # per line; stripped lines stay aligned with the originals
+        clean_text = _ANSI_COLOR_RE.sub("", plan_text)
+
         summary = "\n".join(
             line
-            for line in plan_text.splitlines()
-            if len((clean_line := strip_color(line)).strip()) > 0
+            for line, clean_line in zip(plan_text.splitlines(), clean_text.splitlines())
+            if len(clean_line.strip()) > 0
             # Starts with spaces and a change indicator or a bold #
-            and (re.search(r"\s{2,}[~+-]", clean_line) or line.startswith("\x1b[1m  #"))
+            and (_CHANGE_LINE_RE.search(clean_line) or line.startswith("\x1b[1m  #"))
         ).replace("\x1b[1m  #", "\n\x1b[1m  #")
 
         return summary.strip()
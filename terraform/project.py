@@ -1,14 +1,16 @@
-import json
+import concurrent.futures
+import functools
 import logging
 import os
 import pathlib
-import re
 import subprocess
+import threading
 
 import typing
-from collections import defaultdict
 from concurrent.futures.thread import ThreadPoolExecutor
 
+import orjson
+
 PathValidator = typing.Callable[[pathlib.Path], bool]
 PathMetadataParser = typing.Callable[[pathlib.Path], typing.Dict[str, typing.Any]]
 
@@ -19,16 +21,61 @@ TERRAFORM_CONFIG_INSPECTOR = str(
     )
 )
 
+# terraform-config-inspect has no server mode, so the next best thing
+# is a long-lived worker that reads module paths on stdin and emits one
+# JSON document per path followed by an ASCII record-separator line
+# carrying the inspector's exit status. Keeps one pipe round-trip per
+# module instead of one subprocess setup
+_INSPECT_WORKER_SCRIPT = (
+    "while IFS= read -r p; do "
+    f'"{TERRAFORM_CONFIG_INSPECTOR}" --json "$p"; '
+    "printf '\\036 %s\\n' \"$?\"; "
+    "done"
+)
+
+
+def _scan_for_file(dir_path: str, file_name: str) -> typing.Iterator[str]:
+    """
+    Recursively yields paths to file_name under dir_path using
+    os.scandir, pruning .terraform directories (provider/plugin trees)
+    at descent so they're never walked or stat'd
+    :param dir_path: directory to walk
+    :param file_name: exact file name to find
+    :return: iterator of matching file paths
+    """
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name == ".terraform":
+                    continue
+                yield from _scan_for_file(entry.path, file_name)
+            elif entry.name == file_name and entry.is_file(follow_symlinks=False):
+                yield entry.path
+
+
+_S3_BACKEND_NEEDLE = b'backend "s3" {'
+
 
 def contains_s3_backend(file_path: pathlib.Path) -> bool:
     """
-    Naively checks file for an S3 backend configuration
+    Naively checks file for an S3 backend configuration, scanning in
+    64 KB binary chunks (no decode, no full-file string) and stopping
+    at the first hit. Backend blocks are near the top so most files
+    exit on the first chunk
     :param file_path: file to check for backend
     :return: whether backend config was found
     """
-    with open(str(file_path.resolve()), "r") as f:
-        contents = f.read()
-    return 'backend "s3" {' in contents
+    overlap = len(_S3_BACKEND_NEEDLE) - 1
+    tail = b""
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            # Also check the seam in case the needle straddles chunks
+            if _S3_BACKEND_NEEDLE in chunk or _S3_BACKEND_NEEDLE in (
+                tail + chunk[:overlap]
+            ):
+                return True
+            tail = chunk[-overlap:]
+    return False
 
 
 def project_environment_region_parser(file_path: pathlib.Path) -> typing.Dict[str, str]:
@@ -48,6 +95,17 @@ def project_environment_region_parser(file_path: pathlib.Path) -> typing.Dict[st
     return dict(zip(("project", "environment", "region"), parts))
 
 
+# Sort weight per environment; unknown environments fall between
+# partner_testing and production
+_ENVIRONMENT_ORDER = {
+    "deploy_testing": 1,
+    "staging": 2,
+    "ci": 2,
+    "partner_testing": 3,
+    "production": 5,
+}
+
+
 def environment_sorter(
     path: pathlib.Path, metadata: typing.Dict[pathlib.Path, typing.Dict]
 ) -> int:
@@ -58,18 +116,7 @@ def environment_sorter(
     :param metadata:
     :return:
     """
-    environment_order = defaultdict(lambda: 4)
-    environment_order.update(
-        {
-            "deploy_testing": 1,
-            "staging": 2,
-            "ci": 2,
-            "partner_testing": 3,
-            "production": 5,
-        }
-    )
-
-    return environment_order[metadata[path].get("environment", "")]
+    return _ENVIRONMENT_ORDER.get(metadata[path].get("environment", ""), 4)
 
 
 class ProjectFinder:
@@ -77,18 +124,27 @@ class ProjectFinder:
     DEFAULT_PROJECT_VALIDATOR = contains_s3_backend
     DEFAULT_PROJECT_SORTER = environment_sorter
 
+    # Inspector output is a pure function of a module's contents, so
+    # directories shared between projects (../../modules/...) only get
+    # inspected once per main.tf mtime, process-wide
+    _inspect_cache: typing.Dict[typing.Tuple[str, float], typing.Dict] = {}
+    _inspect_cache_lock = threading.Lock()
+
     @staticmethod
     def find_projects(
         path: pathlib.Path, path_validator: PathValidator
     ) -> typing.List[pathlib.Path]:
-        candidate_paths = path.rglob(ProjectFinder.DEFAULT_FILE_NAME)
+        # Resolving the scan root once makes every candidate path
+        # canonical already (the walker never follows symlinked
+        # directories), so project paths are plain dirname strings
+        # instead of one realpath chain per project
+        candidate_paths = _scan_for_file(
+            str(path.resolve()), ProjectFinder.DEFAULT_FILE_NAME
+        )
         return [
-            p.parent.resolve()
-            for p in candidate_paths
-            if not any(
-                parent.is_dir() and parent.name == ".terraform" for parent in p.parents
-            )
-            and path_validator(p)
+            pathlib.Path(os.path.dirname(candidate))
+            for candidate in candidate_paths
+            if path_validator(pathlib.Path(candidate))
         ]
 
     def __init__(
@@ -116,6 +172,13 @@ class ProjectFinder:
         self.path_parser = path_parser
         self.projects = self.find_projects(self.base_path, path_validator)
         self.project_metadata = {}
+        # Separate pool for the per-module inspector subprocesses so
+        # projects waiting on their modules can't starve each other
+        self._inspect_pool = ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2)
+        # One persistent inspector worker per pool thread (see
+        # _INSPECT_WORKER_SCRIPT) so concurrent inspections don't
+        # serialize on a single worker's pipes
+        self._inspect_local = threading.local()
 
         with ThreadPoolExecutor(max_workers=4) as pool:
             results = [(p, pool.submit(self.inspect_project, p)) for p in self.projects]
@@ -125,58 +188,168 @@ class ProjectFinder:
                     self.path_parser(result[0].relative_to(self.base_path))
                 )
 
+        self.module_index = self._build_module_index()
+
+    def _build_module_index(
+        self,
+    ) -> typing.Dict[pathlib.Path, typing.Set[pathlib.Path]]:
+        """
+        Maps every project and local-module directory (resolved) to
+        the set of projects owning it — shared local modules have
+        several — so change matching is one dict probe
+        :return: directory -> owning projects map
+        """
+        module_index = {}
+        for project, metadata in self.project_metadata.items():
+            module_index.setdefault(project.resolve(), set()).add(project)
+            for module in metadata["config"]["local_modules"].values():
+                module_index.setdefault(module.resolve(), set()).add(project)
+        return module_index
+
+    @classmethod
+    def restore(cls, state: typing.Dict[str, typing.Any]) -> "ProjectFinder":
+        """
+        Rebuilds a finder from a previously-saved scan (see save_state)
+        without walking the tree or re-running the config inspector
+        :param state: dict produced by save_state
+        :return: finder with projects/metadata populated
+        """
+        finder = cls.__new__(cls)
+        finder._logger = logging.getLogger(__name__)
+        finder.base_path = state["base_path"]
+        finder.path_parser = None
+        finder.projects = state["projects"]
+        finder.project_metadata = state["project_metadata"]
+        finder.module_index = finder._build_module_index()
+        # Restored finders can still inspect (e.g. a new project added
+        # after the snapshot), so give them working inspector plumbing
+        finder._inspect_pool = ThreadPoolExecutor(
+            max_workers=(os.cpu_count() or 1) * 2
+        )
+        finder._inspect_local = threading.local()
+        return finder
+
+    def save_state(self) -> typing.Dict[str, typing.Any]:
+        """
+        Returns the scan results in a picklable form for restore
+        """
+        return {
+            "base_path": self.base_path,
+            "projects": self.projects,
+            "project_metadata": self.project_metadata,
+        }
+
+    def _inspect_worker(self) -> subprocess.Popen:
+        """
+        Returns the calling thread's persistent inspector worker,
+        starting (or restarting) it if needed
+        :return: worker process with stdin/stdout pipes
+        """
+        worker = getattr(self._inspect_local, "worker", None)
+        if worker is None or worker.poll() is not None:
+            worker = subprocess.Popen(
+                ["bash", "-c", _INSPECT_WORKER_SCRIPT],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                # The inspector only parses HCL; don't copy the whole
+                # environment (or any stray fds) into every worker
+                env={"PATH": os.environ.get("PATH", "")},
+                close_fds=True,
+            )
+            self._inspect_local.worker = worker
+        return worker
+
+    def _inspect_module(self, module_path: pathlib.Path) -> typing.Dict:
+        """
+        Runs terraform-config-inspect over a single module via the
+        thread's persistent worker
+        :param module_path:
+        :return: parsed inspector output
+        """
+        try:
+            mtime = (module_path / self.DEFAULT_FILE_NAME).stat().st_mtime
+        except OSError:
+            mtime = module_path.stat().st_mtime
+        key = (str(module_path.resolve()), mtime)
+        with self._inspect_cache_lock:
+            if key in self._inspect_cache:
+                self._logger.debug("Inspector cache hit for %s", module_path)
+                return self._inspect_cache[key]
+
+        self._logger.info("Checking %s", module_path)
+        worker = self._inspect_worker()
+        worker.stdin.write(f"{module_path}\n".encode())
+        worker.stdin.flush()
+        # Pipes stay binary end to end; orjson parses the raw bytes
+        output = []
+        status = None
+        for line in worker.stdout:
+            if line.startswith(b"\x1e"):
+                status = int(line[1:])
+                break
+            output.append(line)
+        # Surface inspector failures (or a dead worker) with the
+        # offending module named, like check_output used to
+        if status != 0:
+            raise subprocess.CalledProcessError(
+                status if status is not None else -1,
+                [TERRAFORM_CONFIG_INSPECTOR, "--json", str(module_path)],
+            )
+        details = orjson.loads(b"".join(output))
+
+        with self._inspect_cache_lock:
+            self._inspect_cache[key] = details
+        return details
+
     def inspect_project(
         self, path: pathlib.Path
     ) -> typing.Dict[str, typing.Dict[str, typing.Dict]]:
         """
-        Recurses through path grabbing project module and resource metadata
+        Recurses through path grabbing project module and resource
+        metadata, fanning the per-module inspector subprocesses out to
+        a thread pool and submitting local modules as they're found
         :param path:
         :return: Dict[resources, local_modules, remote_modules]
         """
-        terraform_modules = [("", path)]
         managed_resources = {}
         local_modules = {}
         remote_modules = {}
 
-        while len(terraform_modules) > 0:
-            prefix, module_path = terraform_modules.pop(0)
-            self._logger.info("Checking %s", module_path)
-
-            details = json.loads(
-                subprocess.check_output(
-                    [
-                        TERRAFORM_CONFIG_INSPECTOR,
-                        "--json",
-                        module_path,
-                    ],
-                    text=True,
-                )
+        pending = {self._inspect_pool.submit(self._inspect_module, path): ""}
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
             )
+            for future in done:
+                prefix = pending.pop(future)
+                details = future.result()
 
-            managed_resources.update(
-                {f"{prefix}{k}": v for k, v in details["managed_resources"].items()}
-            )
+                managed_resources.update(
+                    {f"{prefix}{k}": v for k, v in details["managed_resources"].items()}
+                )
 
-            for name, metadata in details["module_calls"].items():
-                module_name = f"{prefix}module.{metadata['name']}"
-                if (
-                    any(
-                        metadata["source"].startswith(prefix)
-                        for prefix in ("./", "../", "/")
-                    )
-                    and (
-                        module_absolute_path := pathlib.Path(path) / metadata["source"]
-                    ).is_dir()
-                ):
-                    self._logger.debug("Local module %s", metadata["source"])
-                    # noinspection PyUnboundLocalVariable
-                    terraform_modules.append(
-                        (f"{prefix}module.{metadata['name']}.", module_absolute_path)
-                    )
-                    local_modules[module_name] = module_absolute_path.resolve()
-                else:
-                    self._logger.debug("Non-local module %s", metadata["source"])
-                    remote_modules[module_name] = metadata["source"]
+                for name, metadata in details["module_calls"].items():
+                    module_name = f"{prefix}module.{metadata['name']}"
+                    if (
+                        any(
+                            metadata["source"].startswith(source_prefix)
+                            for source_prefix in ("./", "../", "/")
+                        )
+                        and (
+                            module_absolute_path := pathlib.Path(path)
+                            / metadata["source"]
+                        ).is_dir()
+                    ):
+                        self._logger.debug("Local module %s", metadata["source"])
+                        pending[
+                            self._inspect_pool.submit(
+                                self._inspect_module, module_absolute_path
+                            )
+                        ] = f"{prefix}module.{metadata['name']}."
+                        local_modules[module_name] = module_absolute_path.resolve()
+                    else:
+                        self._logger.debug("Non-local module %s", metadata["source"])
+                        remote_modules[module_name] = metadata["source"]
 
         return {
             "resources": managed_resources,
@@ -219,38 +392,45 @@ class ChangeFinder:
 
         changed_directories = [p if p.is_dir() else p.parent for p in changed_files]
 
+        # One probe of the finder's reverse index per directory; a
+        # shared local module maps to every project sourcing it
+        module_index = self._project_finder.module_index
         changes = set()
         for directory in changed_directories:
-            if any(directory.samefile(p) for p in self._project_finder.projects):
-                changes.add(directory)
-            else:
-                for project in self._project_finder.projects:
-                    metadata = self._project_finder.project_metadata[project]
-                    if any(
-                        directory.samefile(module)
-                        for module in metadata["config"]["local_modules"].values()
-                    ):
-                        changes.add(project)
-
+            changes.update(module_index.get(directory.resolve(), ()))
         return list(changes)
 
+    @functools.lru_cache(maxsize=None)
     def git_diff(
         self,
-        target_branch: str = subprocess.check_output(
-            ["git", "rev-parse", "--abbrev-ref", "origin/HEAD"], text=True
-        ).strip(),  # TODO decide if putting this here is a good idea
+        target_branch: str = None,
         git_terraform_directory: pathlib.Path = pathlib.Path("terraform/"),
     ) -> typing.List[pathlib.Path]:
         """
         Finds changed projects based on comparing a git branch
         to the current working tree
-        :param target_branch: branch to compare to
+        :param target_branch: branch to compare to (defaults to origin/HEAD)
         :param git_terraform_directory: Terraform base_path relative to git repository (i.e. "terraform" for repo/terraform)
         :return: list of changed projects
         """
-
-        # All changes
-        git_results = subprocess.check_output(
+        if target_branch is None:
+            target_branch = subprocess.check_output(
+                ["git", "rev-parse", "--abbrev-ref", "origin/HEAD"],
+                cwd=self._project_finder.base_path,
+                text=True,
+            ).strip()
+
+        # All changed Terraform files, streamed so a large diff is
+        # processed a path at a time instead of buffered whole. The
+        # prefix pattern is just "optional leading directory", so
+        # prefix-strip instead of building and running a regex per file
+        prefix = str(git_terraform_directory).rstrip("/")
+        # One realpath for the base; per-file paths are normalized at
+        # the string level since the repo tree doesn't route changed
+        # files through symlinks
+        base = str(self._project_finder.base_path.resolve())
+        changed_files = []
+        with subprocess.Popen(
             [
                 "git",
                 "diff",
@@ -260,21 +440,20 @@ class ChangeFinder:
                 self._project_finder.base_path.resolve(),
             ],
             cwd=self._project_finder.base_path,
+            stdout=subprocess.PIPE,
             text=True,
-        )
-
-        # All changed Terraform files
-        changed_files = [
-            pathlib.Path(
-                self._project_finder.base_path
-                / re.sub(
-                    "^" + re.escape(str(git_terraform_directory).rstrip("/")) + "/?",
-                    "",
-                    d.strip(),
+        ) as git_process:
+            for line in git_process.stdout:
+                line = line.strip()
+                if line.startswith(prefix):
+                    line = line[len(prefix) :].lstrip("/")
+                changed_files.append(
+                    pathlib.Path(os.path.normpath(os.path.join(base, line)))
                 )
-            ).resolve()
-            for d in git_results.splitlines()
-        ]
+        if git_process.returncode != 0:
+            raise subprocess.CalledProcessError(
+                git_process.returncode, git_process.args
+            )
 
         return self._changed_projects_from_changed_files(changed_files)
 
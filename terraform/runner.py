@@ -4,9 +4,8 @@ import os
 import pathlib
 import re
 import threading
-import time
 import typing
-from collections import OrderedDict
+from concurrent.futures import as_completed
 from concurrent.futures.thread import ThreadPoolExecutor
 
 import non_blocking_process
@@ -23,6 +22,11 @@ class Runner:
     DEFAULT_CRED_HELPER = NoopCredHelper()
     TERRAFORM_ENTRYPOINT = ["bash", "--login", "-c"]
 
+    _INIT_NEEDED_RE = re.compile(r'"terraform\s*init"')
+    # Markers can straddle a poll boundary, so each scan rewinds this
+    # many characters into already-scanned output
+    _SCAN_OVERLAP = 64
+
     def __init__(
         self,
         project: pathlib.Path,
@@ -37,17 +41,17 @@ class Runner:
         self.project = project.expanduser()
         self._cred_helper = lambda: cred_helper.env(self.project)
         self._exec_method = exec_method
+        # The environment doesn't change between commands, so filter
+        # it once here instead of three passes per invocation
+        self._static_env = {
+            k: v
+            for k, v in os.environ.items()
+            if k.lower().startswith(("aws_", "okta_", "artifactory_"))
+        }
 
     def _run_wrapper(
         self, cmd: typing.Iterable[str]
     ) -> non_blocking_process.NonBlockingProcess:
-        aws_vars = {k: v for k, v in os.environ.items() if k.lower().startswith("aws_")}
-        okta_vars = {
-            k: v for k, v in os.environ.items() if k.lower().startswith("okta_")
-        }
-        artifactory_vars = {
-            k: v for k, v in os.environ.items() if k.lower().startswith("artifactory_")
-        }
         self._logger.debug("Running %s with %s", cmd, self._exec_method)
         process = self._exec_method(
             self.TERRAFORM_ENTRYPOINT + list(cmd),
@@ -57,9 +61,7 @@ class Runner:
                 "TF_LOG": "TRACE",
                 "TF_LOG_PATH": str(pathlib.Path(os.environ["HOME"]) / ".terraform.log"),
                 "AWS_SDK_LOAD_CONFIG": "true",
-                **aws_vars,
-                **okta_vars,
-                **artifactory_vars,
+                **self._static_env,
                 **self._cred_helper(),
             },
         )
@@ -78,12 +80,18 @@ class Runner:
         process = self._run_wrapper(
             ["terraform plan -detailed-exitcode -out=default.tfplan"]
         )
+        out_off, err_off = 0, 0
+        seen_line = False
         for _ in range(120):
             self._logger.debug("Checking to see if plan %s started", self.project)
             out = process.readall(stream="stdout")
             err = process.readall(stream="stderr")
-            if "Backend reinitialization required" in out or re.search(
-                r'"terraform\s*init"', err
+            # Only scan output that arrived since the last poll
+            new_out = out[max(out_off - self._SCAN_OVERLAP, 0) :]
+            new_err = err[max(err_off - self._SCAN_OVERLAP, 0) :]
+            out_off, err_off = len(out), len(err)
+            if "Backend reinitialization required" in new_out or self._INIT_NEEDED_RE.search(
+                new_err
             ):
                 self._logger.info("Project %s needs initialized first", self.project)
                 process.wait()
@@ -95,13 +103,16 @@ class Runner:
                     "Restarting plan after initialization for %s", self.project
                 )
                 return self.plan()
-            if "Refreshing Terraform state in-memory prior to plan..." in out:
+            if "Refreshing Terraform state in-memory prior to plan..." in new_out:
                 self._logger.debug("Plan %s started successfully", self.project)
                 break
             # Wait for the first line
-            if ("\n" not in out) and ("\n" not in err):
+            seen_line = seen_line or "\n" in new_out or "\n" in new_err
+            if not seen_line:
                 self._logger.debug("Plan %s waiting for first line", self.project)
-                time.sleep(0.5)
+                # Wakes as soon as the process writes anything instead
+                # of sleeping out the full interval
+                process.wait_for_output(0.5)
                 continue
             elif process.returncode is not None and process.returncode not in (0, 2):
                 break
@@ -145,7 +156,6 @@ class RunnerPool:
         self._projects = list(projects)
         self._cred_helper = cred_helper
         self._max_concurrency = max_concurrency
-        self._results = OrderedDict()
 
     def _run_wrapper(
         self, operation: str
@@ -155,22 +165,26 @@ class RunnerPool:
         self._logger.debug(
             "Creating ThreadPoolExecutor to bootstrap %s jobs", operation
         )
-        pool = ThreadPoolExecutor(max_workers=32)
-        for project in self._projects:
-            self._logger.debug("Queueing job %s for %s", operation, project)
-            project_runner = Runner(
-                project=project,
-                cred_helper=self._cred_helper,
-                exec_method=self._pool.queue,
-            )
-            self._results[project] = pool.submit(getattr(project_runner, operation))
-
-        pool.shutdown(wait=False)
-
-        for project in self._results:
-            self._logger.debug("Getting process for %s", project)
-            proc = self._results[project].result()
-            yield project, proc
+        # Bootstrap threads only exist because Runner.plan can block
+        # waiting for the first output line; at most max_concurrency
+        # plans run at once so more threads than that just sit idle
+        with ThreadPoolExecutor(max_workers=self._max_concurrency) as pool:
+            futures = {}
+            for project in self._projects:
+                self._logger.debug("Queueing job %s for %s", operation, project)
+                project_runner = Runner(
+                    project=project,
+                    cred_helper=self._cred_helper,
+                    exec_method=self._pool.queue,
+                )
+                futures[pool.submit(getattr(project_runner, operation))] = project
+
+            # Hand processes back as they start rather than serializing
+            # on the slowest-so-far project
+            for future in as_completed(futures):
+                project = futures[future]
+                self._logger.debug("Getting process for %s", project)
+                yield project, future.result()
 
     def init(self):
         yield from self._run_wrapper("init")
@@ -1,19 +1,22 @@
-import io
 from collections import namedtuple
 
-from ruamel.yaml import YAML
 import typing
 
+import yaml as _yaml
+
+# libyaml-backed loader/dumper; 5-20x faster than a pure-Python parse
+try:
+    from yaml import CSafeDumper as _SafeDumper, CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeDumper as _SafeDumper, SafeLoader as _SafeLoader
+
 
 def yaml_loads(yaml_text: str) -> typing.Any:
-    return YAML(typ="safe").load(yaml_text)
+    return _yaml.load(yaml_text, Loader=_SafeLoader)
 
 
 def yaml_dumps(obj: typing.Any) -> str:
-    output = io.StringIO()
-    YAML().dump(obj, output)
-    output.seek(0)
-    return output.read()
+    return _yaml.dump(obj, Dumper=_SafeDumper, default_flow_style=False)
 
 
 # yaml.loads(str) -> obj, yaml.dumps(obj) -> str